@@ -43,9 +43,32 @@ Options:
     --delay=DELAY               Set the time in seconds to wait between downloading each page of the magazine. (Optional)
                                 There is no delay if absent. The value of the delay may be integer or decimal.
                                 Used both whenenever probing for the last valid page number of the magazine and
-                                between downloading each individual page for all quality settings except 'original'.
+                                between starting the download of each individual page for all quality settings except
+                                'original'.
                                 [default: 0]
 
+    --workers=WORKERS           Set the number of magazine pages to download at the same time. (Optional)
+                                Not used with '--quality=original'.
+                                [default: 8]
+
+    --connections=CONNECTIONS   Set the maximum number of connections kept open to the image server. (Optional)
+                                Not used with '--quality=original'.
+                                [default: 8]
+
+    --cache-dir=DIR             Keep the downloaded magazine pages in this directory, so that pages which have been
+                                downloaded before are read from it instead of being downloaded again. (Optional)
+                                Not used with '--quality=original'.
+                                [default: ~/.cache/pocketmagstopdf]
+
+    --cache-size=MEGABYTES      Set the maximum size of the cache directory in megabytes. After each download, the least
+                                recently used pages are deleted from it until it is no larger than this. (Optional)
+                                Not used with '--quality=original'.
+                                [default: 1024]
+
+    --no-cache                  Do not read or save downloaded magazine pages in the cache directory. (Optional)
+                                Not used with '--quality=original'.
+                                [default: False]
+
     --save-images               Save the downloaded JPEG images of the magazine pages to a subdirectory with the same
                                 name as the magazine in addition to generating the PDF of the magazine.
                                 Not used with '--quality=original'.
@@ -114,27 +137,39 @@ Notes:
 
 """
 
-import binascii
+import hashlib
+import mmap
 import os.path
+import queue
 import random
 import re
+import shutil
+import struct
+import tempfile
+import threading
 import uuid
 import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from io import BytesIO
 from time import sleep
-from urllib.error import HTTPError
 from urllib.parse import urlparse, urlunparse
-from urllib.request import urlopen
+from xml.etree import ElementTree
 import logging
 
 import PIL
 import docopt
 import requests as requests
 from PIL import Image
+from reportlab import rl_config
 from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(
@@ -143,9 +178,23 @@ logging.basicConfig(
 )
 
 
-# The pattern of the URL path for a magazine
-URL_PATH_PATTERN = re.compile(
-    r'(?P<prefix>^/mcmags/(?P<bucket_uuid>[a-f0-9\-]+)/(?P<magazine_uuid>[a-f0-9\-]+))/(?P<imagequality>(extralow|low|mid|high|extrahigh))/[0-9]{4}.(bin|jpg)')
+# The image qualities that appear in the URL path for a magazine, which has the form:
+# /mcmags/<bucket_uuid>/<magazine_uuid>/<imagequality>/<4-digit page number>.<bin|jpg>
+URL_PATH_QUALITIES = ('extralow', 'low', 'mid', 'high', 'extrahigh')
+URL_PATH_EXTENSIONS = ('bin', 'jpg')
+
+# While downloading, progress is reported once every this many pages. The details of each page are only logged with
+# '--debug'.
+PROGRESS_INTERVAL = 10
+
+# The (connect, read) timeouts in seconds for every request. The read timeout applies to each wait for more data, so a
+# server that stops sending part way through a page fails that download instead of blocking it forever.
+REQUEST_TIMEOUT = (10, 60)
+
+# The names of the files in the page cache directory: the SHA-1 of each page's URL, and the temporary files pages are
+# written to before being moved into place. prune_cache() leaves any other files in the directory alone.
+CACHE_TEMP_FILE_PREFIX = '.pocketmagstopdf-'
+CACHE_FILE_NAME_PATTERN = re.compile(r'[0-9a-f]{40}|' + re.escape(CACHE_TEMP_FILE_PREFIX) + r'[a-z0-9_]+')
 
 # GitHub issue #7 reports extrahigh/0000.bin as a new quality level: https://github.com/RichardJRL/pocketmagstopdf/issues/7
 # But it does not exist for the (older) example magazine used here:
@@ -182,7 +231,7 @@ URL_PATH_PATTERN = re.compile(
 # high:     1448 x 2048
 # extrahigh:2171 x 3072
 
-QUALITY_PATTERN = re.compile("(extralow|low|mid|high|extrahigh|original)")
+QUALITIES = URL_PATH_QUALITIES + ('original',)
 
 # Notes on the "high" image size with the "bin" file extension.
 # Running the Linux "file" command gives the output:
@@ -213,8 +262,17 @@ QUALITY_PATTERN = re.compile("(extralow|low|mid|high|extrahigh|original)")
 # Extension should be .webp
 # See also: https://developers.google.com/speed/webp/docs/riff_container#webp_file_header
 
+# The first two bytes of the "high" (JPEG) and "extrahigh" (RIFF/webp) quality "bin" files, which are zeroed on the server
+JPEG_FILE_TYPE_CODE = b'\xff\xd8'
+RIFF_FILE_TYPE_CODE = b'\x52\x49'
+
 # The pattern for a standard UUID, used to identify storage blobs, magazines and users
-UUID_PATTERN = re.compile("^[a-z0-9]{8}-([a-z0-9]{4}-){3}[a-z0-9]{12}$")
+UUID_PATTERN = re.compile("[a-z0-9]{8}-(?:[a-z0-9]{4}-){3}[a-z0-9]{12}")
+
+# The pattern for the start of every object in a PDF downloaded in 'original' quality. The named group that matches
+# tells apart the User UUID watermark stream ('<</Length ') and opacity objects and the iTextSharp object.
+PDF_HEADER_OBJECT_PATTERN = re.compile(rb'<</(?:(?P<length>Length )|(?P<producer>Producer\(iTextSharp)|'
+                                       rb'(?P<opacity>ca 0\.35/CA 0\.3>>))?')
 
 
 @contextmanager
@@ -226,16 +284,669 @@ def saving(thing):
         thing.save()
 
 
+def jpeg_size(data):
+    """
+    Read the width and height of a JPEG image from its frame header, without decoding the image.
+    Raises ValueError if data is not a JPEG image that reportlab can embed in a PDF.
+    """
+    if data[0:2] != JPEG_FILE_TYPE_CODE:
+        raise ValueError('Not a JPEG image')
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise ValueError('Corrupt JPEG marker at byte {}'.format(offset))
+        marker = data[offset + 1]
+        # Skip fill bytes and the markers that have no segment following them
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            offset += 2
+            continue
+        # The start of frame markers are 0xC0 to 0xCF, apart from DHT (0xC4), JPG (0xC8) and DAC (0xCC).
+        # The segment holds the sample precision, then the height and width as big-endian 16-bit integers.
+        # reportlab only embeds baseline, extended sequential and progressive (0xC0 to 0xC2) images with 8-bit samples,
+        # and silently draws a placeholder instead of any other JPEG image, so those are rejected here.
+        if marker in (0xC0, 0xC1, 0xC2):
+            if offset + 9 > len(data):
+                break
+            (precision, height, width) = struct.unpack_from('>BHH', data, offset + 4)
+            if precision != 8:
+                raise ValueError('Unsupported JPEG sample precision of {} bits'.format(precision))
+            return width, height
+        if 0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise ValueError('Unsupported JPEG frame type 0x{:02X}'.format(marker))
+        (segment_length,) = struct.unpack_from('>H', data, offset + 2)
+        offset += 2 + segment_length
+    raise ValueError('No frame header found in JPEG image')
+
+
+class JPEGImageReader(ImageReader):
+    """
+    ImageReader for a BytesIO holding JPEG data, which reportlab embeds in the PDF without decoding it.
+    The size of the image is read from the JPEG frame header, so Pillow is not needed at all.
+    The image is identified by a hash of its JPEG data, so pages with identical JPEG data, such as a repeated advert,
+    are only embedded in the PDF once.
+
+    This relies on the following reportlab 3.6 behaviour, which requirements.txt pins reportlab to and
+    test_pocketmagstopdf.py checks:
+    - Canvas.drawImage() names an ImageReader's image after getRGBData() and _dataA, and reuses the existing XObject
+      when the name has been seen before.
+    - PDFImageXObject embeds the file returned by jpeg_fh() as a DCTDecode stream, without calling getRGBData(), as long
+      as reportlab's readJPEGInfo() accepts it, which jpeg_size() makes sure of.
+    - ImageReader.identity() and getSize() only need the _ident, fileName, fp, _width and _height attributes, which
+      ImageReader.__init__() would set by opening the image with Pillow.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.fileName = 'JPEG_%d' % id(self)
+        self._image = None
+        self._dataA = None
+        with fp.getbuffer() as data:
+            (self._width, self._height) = jpeg_size(data)
+            self._ident = hashlib.sha1(data).hexdigest()
+
+    def jpeg_fh(self):
+        self.fp.seek(0)
+        return self.fp
+
+    def getRGBData(self):
+        """
+        Return the hash of the JPEG data rather than its pixels. Canvas.drawImage() only uses this to name the image.
+        """
+        return self._ident.encode('ascii')
+
+    def getImageData(self):
+        raise NotImplementedError('The pixels of a JPEG page are never decoded')
+
+    def getTransparent(self):
+        return None
+
+
+def parse_url_path(path):
+    """
+    Split the URL path for a magazine into its prefix, storage bucket UUID and magazine UUID.
+    Returns None if the path does not have the expected form. The path is split on '/' rather than matched against a
+    regular expression, as its form is fixed.
+    """
+    parts = path.split('/')
+    if len(parts) != 6 or parts[0] != '' or parts[1] != 'mcmags' or parts[4] not in URL_PATH_QUALITIES:
+        return None
+    (page, dot, extension) = parts[5].partition('.')
+    if len(page) != 4 or not (page.isascii() and page.isdigit()) or extension not in URL_PATH_EXTENSIONS:
+        return None
+    return '/'.join(parts[:4]), parts[2], parts[3]
+
+
+def page_url_maker(url, prefix, quality, file_extension):
+    """
+    Return a function giving the URL of a page of the magazine from its (0-based) page number, in the given quality.
+    Only the page number changes between the page URLs, so the rest of the URL is built once.
+    """
+    page_url_start = '{}://{}{}/{}/'.format(url.scheme, url.netloc, prefix, quality)
+    page_url_end = urlunparse(('', '', '.' + file_extension, url.params, url.query, url.fragment))
+
+    def page_url_for(page_num):
+        return '{}{:04d}{}'.format(page_url_start, page_num, page_url_end)
+
+    return page_url_for
+
+
+def cache_path_for(cache_dir, page_url):
+    """Path of the file in cache_dir that holds the page downloaded from page_url."""
+    return os.path.join(cache_dir, hashlib.sha1(page_url.encode()).hexdigest())
+
+
+def is_image_file(filedata):
+    """Check whether the contents of a page start like a JPEG or RIFF/webp image file."""
+    return filedata[0:2] == JPEG_FILE_TYPE_CODE or (filedata[0:4] == b'RIFF' and filedata[8:12] == b'WEBP')
+
+
+def fetch_page(session, page_url, file_type_code, cache_dir=None):
+    """
+    Download one page of the magazine and restore the file type code at its start, unless file_type_code is None.
+    Returns the page's contents, or None if the page does not exist.
+    If cache_dir is given, the page is read from it when it has been downloaded before, and saved to it otherwise.
+    Only contents that look like an image file are saved, so an error page or an empty response is downloaded again on
+    the next run rather than being read from the cache forever.
+    """
+    if cache_dir is not None:
+        cache_path = cache_path_for(cache_dir, page_url)
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                filedata = bytearray(os.fstat(cache_file.fileno()).st_size)
+                cache_file.readinto(filedata)
+            # Mark the page as recently used, so prune_cache() removes it after the pages that have not been read since
+            os.utime(cache_path)
+            LOGGER.debug('Read {} from the page cache at {}'.format(page_url, cache_path))
+            return filedata
+        except FileNotFoundError:
+            pass
+
+    filedata = download_page(session, page_url)
+    if filedata is None:
+        return None
+    # Rewrite the beginning of a "bin" file to include the proper file type code. The downloaded buffer is patched in
+    # place rather than copied, and is saved to the cache already patched.
+    if file_type_code is not None:
+        filedata[0:2] = file_type_code
+    if cache_dir is not None and is_image_file(filedata):
+        # Write to a temporary file first so that an interrupted run never leaves a partial page in the cache
+        (temp_fd, temp_path) = tempfile.mkstemp(prefix=CACHE_TEMP_FILE_PREFIX, dir=cache_dir)
+        try:
+            with os.fdopen(temp_fd, 'wb') as temp_file:
+                temp_file.write(filedata)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    return filedata
+
+
+def prune_cache(cache_dir, max_size):
+    """
+    Delete the least recently used pages from cache_dir until the pages left in it take up at most max_size bytes.
+    Only the files the page cache creates are counted and deleted, in case cache_dir also holds other files.
+    """
+    cache_files = []
+    with os.scandir(cache_dir) as entries:
+        for entry in entries:
+            if CACHE_FILE_NAME_PATTERN.fullmatch(entry.name) and entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+    cache_size = sum(size for (mtime, size, path) in cache_files)
+    cache_files.sort()
+    for (mtime, size, path) in cache_files:
+        if cache_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        cache_size -= size
+        LOGGER.debug('Removed {} from the page cache'.format(path))
+
+
+def download_page(session, page_url):
+    """Download one page of the magazine. Returns the page's contents, or None if the page does not exist."""
+    response = session.get(page_url, stream=True, timeout=REQUEST_TIMEOUT)
+    try:
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return read_response(response)
+    finally:
+        response.close()
+
+
+def read_response(response):
+    """
+    Read the body of a streamed response straight into a buffer of the size given by the server, rather than growing
+    it as it arrives. Returns the body as a bytearray, which can be edited in place.
+    """
+    content_length = int(response.headers.get('Content-Length', 0))
+    if content_length == 0 or 'Content-Encoding' in response.headers:
+        return bytearray(response.content)
+    content = bytearray(content_length)
+    content_view = memoryview(content)
+    bytes_read = 0
+    while bytes_read < content_length:
+        try:
+            chunk_length = response.raw.readinto(content_view[bytes_read:])
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e, request=response.request, response=response)
+        if chunk_length == 0:
+            raise requests.exceptions.ConnectionError(
+                'Connection closed after {} of {} bytes of {}'.format(bytes_read, content_length, response.url))
+        bytes_read += chunk_length
+    return content
+
+
+def page_exists(session, page_url, cache_dir=None):
+    """Check whether a page of the magazine exists, without downloading it."""
+    if cache_dir is not None and os.path.exists(cache_path_for(cache_dir, page_url)):
+        return True
+    response = session.head(page_url, timeout=REQUEST_TIMEOUT)
+    LOGGER.debug("HTTP response code {} for URL {}".format(response.status_code, page_url))
+    if response.status_code == 404:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def list_pages(session, url, prefix, quality, file_extension):
+    """
+    Ask the storage server for the list of the magazine's pages in the given quality, in a single request.
+    Returns the set of (0-based) page numbers found, or None if the server does not allow its pages to be listed or its
+    list does not hold any pages, so that find_last_page() probes for the pages instead.
+    """
+    (container, slash, blob_prefix) = prefix.lstrip('/').partition('/')
+    blob_prefix = '{}/{}/'.format(blob_prefix, quality)
+    container_url = urlunparse((url.scheme, url.netloc, '/' + container, '', url.query, ''))
+    response = session.get(container_url,
+                           params={'restype': 'container', 'comp': 'list', 'prefix': blob_prefix, 'maxresults': 5000},
+                           timeout=REQUEST_TIMEOUT)
+    LOGGER.debug("HTTP response code {} for the list of pages at {}".format(response.status_code, response.url))
+    if response.status_code != 200:
+        return None
+    try:
+        enumeration_results = ElementTree.fromstring(response.content)
+    except ElementTree.ParseError:
+        return None
+    # Any other XML is not a list of blobs.
+    # A magazine has fewer pages than fit in one response, so a list continued in another response is not expected.
+    if enumeration_results.tag != 'EnumerationResults' or enumeration_results.findtext('NextMarker'):
+        return None
+
+    page_nums = set()
+    for blob_name in enumeration_results.iter('Name'):
+        name = blob_name.text or ''
+        (page, dot, extension) = name[len(blob_prefix):].partition('.')
+        if (name.startswith(blob_prefix) and len(page) == 4 and page.isascii() and page.isdigit()
+                and extension == file_extension):
+            page_nums.add(int(page))
+    return page_nums or None
+
+
+def find_last_page(session, page_url_for, first_page, last_page, delay, cache_dir=None, listed_pages=None):
+    """
+    Find the number of the last page of the magazine, searching from first_page up to at most last_page.
+    page_url_for(page_num) gives the URL of a page. Returns None if first_page does not exist.
+    If listed_pages, the page numbers from list_pages(), is given, the pages are looked up in it and not probed.
+    Otherwise the step between probed pages doubles until a page is not found, then the last page is found by
+    bisection, so only about 2 * log2(number of pages) pages are probed.
+    """
+    if listed_pages is not None:
+        if first_page not in listed_pages:
+            return None
+        last_good_page = first_page
+        while last_good_page < last_page and last_good_page + 1 in listed_pages:
+            last_good_page += 1
+        return last_good_page
+
+    if not page_exists(session, page_url_for(first_page), cache_dir):
+        return None
+    last_good_page = first_page
+    first_bad_page = None
+    page_jump = 1
+    while first_bad_page is None:
+        page_num = min(last_good_page + page_jump, last_page)
+        if page_num == last_good_page:
+            return last_good_page
+        sleep(delay)
+        if page_exists(session, page_url_for(page_num), cache_dir):
+            last_good_page = page_num
+            page_jump *= 2
+        else:
+            first_bad_page = page_num
+    while first_bad_page - last_good_page > 1:
+        page_num = (last_good_page + first_bad_page) // 2
+        sleep(delay)
+        if page_exists(session, page_url_for(page_num), cache_dir):
+            last_good_page = page_num
+        else:
+            first_bad_page = page_num
+        LOGGER.debug("Last good page number: {}, first bad page number: {}".format(last_good_page, first_bad_page))
+    return last_good_page
+
+
+def read_webp(imgdata):
+    """
+    Decode a webp page, which PDF does not support, into an image reader holding its RGB data.
+    The format of every page is known, so Pillow is not left to try each of its image plugins.
+    """
+    image = ImageReader(Image.open(imgdata, formats=('WEBP',)))
+    image.getRGBData()
+    return image
+
+
+def page_loader(quality):
+    """
+    Return the (file type code, image reader) pair used by load_page() for pages of the given quality. The file type
+    code is None when the downloaded files need no changes.
+    """
+    # The extralow, low & mid quality "jpg" format URLs need no changes.
+    # The high quality "bin" format URL has the JPEG file type code zeroed, the extrahigh one the RIFF/webp code.
+    # JPEG pages are embedded in the PDF exactly as downloaded. Only webp pages have to be decoded, which is done on the
+    # download threads so it does not hold up adding pages to the PDF.
+    if quality == 'high':
+        return (JPEG_FILE_TYPE_CODE, JPEGImageReader)
+    elif quality == 'extrahigh':
+        return (RIFF_FILE_TYPE_CODE, read_webp)
+    return (None, JPEGImageReader)
+
+
+def load_page(session, page_url, file_type_code, read_image, cache_dir=None):
+    """
+    Download one page of the magazine and read it as an image ready to be drawn on the PDF canvas, as chosen by
+    page_loader(). Returns (contents, image). Both are None if the page does not exist, and the image is None if the
+    contents are not a valid image file.
+    """
+    filedata = fetch_page(session, page_url, file_type_code, cache_dir)
+    if filedata is None:
+        return (None, None)
+    # BytesIO copies the buffer it is given, so the page is held twice while it is read: filedata is kept for
+    # '--save-images' and the copy is what reportlab embeds or Pillow decodes.
+    try:
+        image = read_image(BytesIO(filedata))
+    except (PIL.UnidentifiedImageError, ValueError):
+        image = None
+    return (filedata, image)
+
+
+def download_pages(session, page_urls, quality, workers, delay, cache_dir, page_queue, stop_downloading):
+    """
+    Download (page number, URL) pairs with up to workers concurrent requests and put (page number, contents, image)
+    tuples from load_page() on page_queue in page order. A new download is started as soon as the oldest one has been
+    queued, so a single slow page does not hold back the pages after it. The contents are None for a page that does not
+    exist, after which no more pages are downloaded. The queue is always finished with None, preceded by the exception
+    if downloading failed. Downloading stops early when stop_downloading is set.
+    """
+
+    def put(item):
+        while not stop_downloading.is_set():
+            try:
+                page_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    (file_type_code, read_image) = page_loader(quality)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            next_page = iter(page_urls)
+            try:
+                while True:
+                    while len(pending) < workers and not stop_downloading.is_set():
+                        (page_num, page_url) = next(next_page, (None, None))
+                        if page_num is None:
+                            break
+                        LOGGER.debug('Downloading page {} from {}...'.format(page_num + 1, page_url))
+                        future = executor.submit(load_page, session, page_url, file_type_code, read_image, cache_dir)
+                        pending.append((page_num, future))
+                        sleep(delay)
+                    if not pending:
+                        return
+                    (page_num, future) = pending.popleft()
+                    (filedata, image) = future.result()
+                    if not put((page_num, filedata, image)) or filedata is None:
+                        return
+            finally:
+                for (page_num, future) in pending:
+                    future.cancel()
+    except Exception as e:
+        put(e)
+    finally:
+        put(None)
+
+
+def edit_original_pdf(pdf_fn, range_from, range_to, user_uuid_hide, user_uuid_destroy, timestamp_change, debug):
+    """
+    Check that a PDF downloaded in 'original' quality has the expected User UUID watermark objects, and hide or destroy
+    the watermarks and change the timestamps as requested.
+    Every edit keeps the length of the PDF the same, so the file is edited in place through a memory map. Only the
+    objects at the beginning of the PDF are read when nothing is to be changed.
+    """
+    LOGGER.info('Editing downloaded magazine...')
+    with open(pdf_fn, 'r+b') as pdf_original, mmap.mmap(pdf_original.fileno(), 0) as pdf_download:
+        # Manipulate various elements of the PDF file
+        number_of_pages = range_to - (range_from - 1)
+
+        # The user UUID watermarks which printed on each page are all added together as objects beginning with
+        # '<</Length' located at the beginning of the PDF file before any of the magazine content appears.
+        # The objects are variable length flate-encoded streams that hold the User UUID amongst other compressed data.
+        # The User UUID never appears in plaintext in the PDF.
+        # It is the first object after the '<</Length' objects  which is not '<</Length' but '<</Type...' or
+        # '<</ArtBox...' or something else that signifies the start of the magazine content.
+        # There should be twice as many '<</Length' objects as pages in the magazine.
+        # The UUID opacity objects, the iTextSharp object (see below) and the '<</Length' objects are all found in a
+        # single pass over the objects at the beginning of the PDF, which stops at the start of the magazine content.
+        # The opacity objects come before the iTextSharp object and the '<</Length' objects come after it.
+        start_of_magazine_content_location = -1
+        itextsharp_object_location = -1
+        uuid_opacity_object_location_list = list()
+        uuid_stream_object_list = list()
+        LOGGER.info('Searching the PDF for the magazine content, the User UUID watermark objects and the iTextSharp '
+                    'object...')
+        for header_object in PDF_HEADER_OBJECT_PATTERN.finditer(pdf_download):
+            if itextsharp_object_location == -1:
+                if header_object.lastgroup == 'opacity':
+                    uuid_opacity_object_location_list.append(header_object.start())
+                elif header_object.lastgroup == 'producer':
+                    itextsharp_object_location = header_object.start()
+            # Find the short/long pairs of flate-encoded stream objects that hold the position and text of the user UUID
+            # watermark on each page
+            elif header_object.lastgroup == 'length':
+                uuid_stream_object_list.append(header_object.start())
+            # Find the first string beginning '<</...' that is not '<</Length'. That is the start of the magazine.
+            else:
+                start_of_magazine_content_location = pdf_download.find(b'>>', header_object.start()) + 1
+                break
+        if len(uuid_stream_object_list) == number_of_pages * 2:
+            LOGGER.debug('Found the expected number of flate-encoded User UUID stream objects')
+            LOGGER.debug(
+                'The number of User UUID stream objects ({}) is twice then number of pages ({}). This is correct.'.format(
+                    len(uuid_stream_object_list), number_of_pages))
+        else:
+            LOGGER.warning(
+                'The number of User UUID stream objects ({}) should be twice then number of pages ({}). It is not.'.format(
+                    len(uuid_stream_object_list), number_of_pages))
+
+        # Print summary of all User UUID stream objects found
+        if debug:
+            for (uuid_stream_object_number, uuid_stream_object_offset) in enumerate(uuid_stream_object_list, 1):
+                LOGGER.debug('{}: User UUID flate-encoded stream object found at offset {}'.format(
+                    uuid_stream_object_number,
+                    hex(uuid_stream_object_offset)))
+
+        # Locate the flate-encoded stream data of the User UUID objects, to destroy it and, out of curiosity, to decode
+        # it. It is only decoded for the debug output.
+        if debug or user_uuid_destroy:
+            LOGGER.debug('Decoding the previously discovered flate-encoded objects containing the User UUID watermarks...')
+            # Each search is bounded by the start of the next object, so a malformed object cannot send it through the
+            # rest of the PDF. An object that does not have the expected form is skipped rather than edited.
+            if start_of_magazine_content_location == -1:
+                start_of_magazine_content_location = len(pdf_download)
+            next_object_locations = uuid_stream_object_list[1:] + [start_of_magazine_content_location]
+            for (uuid_object_counter, (uuid_object_location, next_object_location)) in enumerate(
+                    zip(uuid_stream_object_list, next_object_locations)):
+                length_string_start_offset = uuid_object_location + 10
+                length_string_end_offset = pdf_download.find(b'/Filter/FlateDecode', length_string_start_offset,
+                                                             next_object_location) - 1
+                stream_keyword_location = pdf_download.find(b'>>stream', uuid_object_location, next_object_location)
+                if length_string_end_offset < length_string_start_offset or stream_keyword_location == -1:
+                    LOGGER.warning('User UUID stream object number {} at offset {} is not in the expected form; '
+                                   'skipping it'.format(uuid_object_counter + 1, hex(uuid_object_location)))
+                    continue
+                try:
+                    # int() parses the ASCII digits of the length straight from bytes
+                    flate_encoded_stream_integer_length = int(
+                        pdf_download[length_string_start_offset:length_string_end_offset + 1])
+                except ValueError:
+                    flate_encoded_stream_integer_length = -1
+                if flate_encoded_stream_integer_length < 0:
+                    LOGGER.warning('User UUID stream object number {} at offset {} has an invalid length; '
+                                   'skipping it'.format(uuid_object_counter + 1, hex(uuid_object_location)))
+                    continue
+                # The stream keyword is followed by either a line feed or a carriage return and line feed
+                flate_encoded_stream_start_offset = stream_keyword_location + 8
+                if pdf_download[flate_encoded_stream_start_offset:flate_encoded_stream_start_offset + 2] == b'\r\n':
+                    flate_encoded_stream_start_offset += 2
+                elif pdf_download[flate_encoded_stream_start_offset:flate_encoded_stream_start_offset + 1] == b'\n':
+                    flate_encoded_stream_start_offset += 1
+                flate_encoded_stream_end_offset = flate_encoded_stream_start_offset + flate_encoded_stream_integer_length - 1
+                if flate_encoded_stream_end_offset >= next_object_location:
+                    LOGGER.warning('User UUID stream object number {} at offset {} runs past the next object; '
+                                   'skipping it'.format(uuid_object_counter + 1, hex(uuid_object_location)))
+                    continue
+                if debug:
+                    flate_encoded_stream_content = pdf_download[
+                                                   flate_encoded_stream_start_offset:flate_encoded_stream_end_offset + 1]
+                    flate_encoded_stream_decoded_content = zlib.decompress(flate_encoded_stream_content, wbits=0)
+                    LOGGER.debug('Working on User UUID flate-encoded stream number {}'.format(uuid_object_counter + 1))
+                    LOGGER.debug('User UUID flate-encoded placement length string start offset is {}'.format(
+                        hex(length_string_start_offset)))
+                    LOGGER.debug('User UUID flate-encoded placement length string end offset is {}'.format(
+                        hex(length_string_end_offset)))
+                    LOGGER.debug('User UUID flate-encoded placement stream real integer value is {}'.format(
+                        flate_encoded_stream_integer_length))
+                    LOGGER.debug('User UUID flate-encoded placement stream start offset is {}'.format(
+                        hex(flate_encoded_stream_start_offset)))
+                    LOGGER.debug('User UUID flate-encoded placement stream end offset is {}'.format(
+                        hex(flate_encoded_stream_end_offset)))
+                    LOGGER.debug('User UUID flate-encoded placement stream content byte length is {}'.format(
+                        len(flate_encoded_stream_content)))
+                    LOGGER.debug('User UUID flate-encoded placement stream content is {}'.format(
+                        flate_encoded_stream_content))
+                    LOGGER.debug('User UUID flate-encoded placement decoded stream content is {}'.format(
+                        flate_encoded_stream_decoded_content))
+
+                if user_uuid_destroy:
+                    LOGGER.info('Zeroing the user UUID flate-encoded placement stream data...')
+                    flate_encoded_stream_replacement_content = b'0' * flate_encoded_stream_integer_length
+                    if debug:
+                        LOGGER.debug('User UUID flate-encoded placement replacement stream content is: {}'.format(
+                            flate_encoded_stream_replacement_content))
+                    pdf_download[
+                    flate_encoded_stream_start_offset:flate_encoded_stream_end_offset + 1] = flate_encoded_stream_replacement_content
+
+        # The software that Pocketmags use to add the User UUID watermarks is called iTextSharp and it adds its own
+        # object near the beginning of the PDF in order to advertise itself and add two timestamps.
+        # Its location was found above along with the User UUID watermark objects. Find the two timestamps within it.
+        itextsharp_object_end_location = -1
+        itextsharp_object_creationdate_property_location = -1
+        itextsharp_object_moddate_property_location = -1
+        if itextsharp_object_location == -1:
+            LOGGER.warning('Cannot find the iTextSharp object location in the PDF file.')
+        else:
+            # Find the next 'endobj' tag after the iTextSharp object hast started in order to limit the search range for
+            # the two timestamps that should be associated with it.
+            itextsharp_object_end_location = pdf_download.find(b'endobj', itextsharp_object_location)
+            LOGGER.debug('Byte offset of the iTextSharp object located at {}'.format(hex(itextsharp_object_location)))
+
+            # Find the CreationDate timestamp property location
+            itextsharp_object_creationdate_property_location = pdf_download.find(b'CreationDate',
+                                                                                 itextsharp_object_location,
+                                                                                 itextsharp_object_end_location)
+            if itextsharp_object_creationdate_property_location == -1:
+                LOGGER.warning('Cannot find the iTextSharp object\'s CreationDate property.')
+            else:
+                LOGGER.debug('Byte offset of the iTextSharp object\'s CreationDate property is {}'.format(
+                    hex(itextsharp_object_creationdate_property_location)))
+            # Find the ModDate timestamp property location
+            itextsharp_object_moddate_property_location = pdf_download.find(b'ModDate', itextsharp_object_location,
+                                                                            itextsharp_object_end_location)
+            if itextsharp_object_moddate_property_location == -1:
+                LOGGER.warning('Cannot find the iTextSharp object\'s ModDate property.')
+            else:
+                LOGGER.debug('Byte offset of the iTextSharp object\'s ModDate property is {}'.format(
+                    hex(itextsharp_object_moddate_property_location)))
+
+        # The iTextSharp object CreationDate and ModDate properties hold 14 char YYYYmmddHHMMSS format timestamps.
+        timestamp_length = 14
+        creationdate_timestamp_location = itextsharp_object_creationdate_property_location + 15
+        moddate_timestamp_location = itextsharp_object_moddate_property_location + 10
+        if debug:
+            itextsharp_object_original_content = pdf_download[
+                                                 itextsharp_object_location:itextsharp_object_end_location]
+            creationdate_original_value = pdf_download[
+                                          creationdate_timestamp_location:
+                                          creationdate_timestamp_location + timestamp_length].decode(encoding='cp1252')
+            moddate_original_value = pdf_download[
+                                     moddate_timestamp_location:
+                                     moddate_timestamp_location + timestamp_length].decode(encoding='cp1252')
+            LOGGER.debug('Original iTextSharp CreationDate timestamp is {}, length {}'.format(
+                creationdate_original_value, len(creationdate_original_value)))
+            LOGGER.debug('Original iTextSharp ModDate timestamp is {}, length {}'.format(
+                moddate_original_value, len(moddate_original_value)))
+            LOGGER.debug('iTextSharp object before timestamp modification is: {}'.format(
+                itextsharp_object_original_content))
+
+        if timestamp_change:
+            # Create one new timestamp, used for both the CreationDate and ModDate properties
+            time_now = datetime.now()
+            time_delta = timedelta(microseconds=random.randrange(0, 999),
+                                   milliseconds=random.randrange(0, 999),
+                                   seconds=random.randrange(0, 60),
+                                   minutes=random.randrange(0, 60),
+                                   hours=random.randrange(0, 23),
+                                   days=random.randrange(0, 30),
+                                   weeks=random.randrange(0, 4))
+            time_replacement = time_now + time_delta
+            timestamp_replacement_value = time_replacement.strftime('%Y%m%d%H%M%S').encode(encoding='ascii')
+            LOGGER.info('Changing the PDFs internal timestamps...')
+            # A timestamp whose property was not found (and warned about above) is left alone
+            if itextsharp_object_creationdate_property_location != -1:
+                pdf_download[creationdate_timestamp_location:
+                             creationdate_timestamp_location + timestamp_length] = timestamp_replacement_value
+            if itextsharp_object_moddate_property_location != -1:
+                pdf_download[moddate_timestamp_location:
+                             moddate_timestamp_location + timestamp_length] = timestamp_replacement_value
+            if debug:
+                LOGGER.debug('Replacement iTextSharp CreationDate and ModDate timestamp is {}, length {}'.format(
+                    timestamp_replacement_value, len(timestamp_replacement_value)))
+                LOGGER.debug('iTextSharp object after  timestamp modification is: {}'.format(
+                    pdf_download[itextsharp_object_location:itextsharp_object_end_location]))
+
+        # Check the number of UUID opacity objects found matches the number of pages expected in the magazine
+        uuid_opacity_object_count = len(uuid_opacity_object_location_list)
+        if uuid_opacity_object_count != number_of_pages:
+            LOGGER.warning('The number of UUID opacity objects found ({}) does not equal the number of pages expected '
+                           '({}).'.format(uuid_opacity_object_count, number_of_pages))
+        else:
+            LOGGER.debug(
+                'Number of UUID opacity objects found ({}) equals the number of pages expected ({}). This is good.'.format(
+                    uuid_opacity_object_count, number_of_pages))
+
+        # Print summary of all user UUID opacity objects found
+        if debug:
+            for (uuid_opacity_object_number, uuid_opacity_object_offset) in enumerate(
+                    uuid_opacity_object_location_list, 1):
+                LOGGER.debug('{}: UUID opacity object found at offset {}'.format(uuid_opacity_object_number,
+                                                                          hex(uuid_opacity_object_offset)))
+
+        # Modify user UUID opacity objects to make the UUID less visible
+        # ca = fill (non-stroking), CA = border (stroking)
+        # NB: Do NOT change the length of the uuid_opacity_object_replacement_value string!
+        uuid_opacity_object_replacement_value = b'<</ca 0.35/CA 0.3>>'
+        if user_uuid_hide:
+            uuid_opacity_object_replacement_value = b'<</ca 0.00/CA 0.0>>'
+        if user_uuid_destroy:
+            uuid_opacity_object_replacement_value = b'0000000000000000000'
+        if user_uuid_hide or user_uuid_destroy:
+            LOGGER.info('Changing the User UUID watermark opacity...')
+            replacement_length = len(uuid_opacity_object_replacement_value)
+            for uuid_opacity_object_location in uuid_opacity_object_location_list:
+                pdf_download[uuid_opacity_object_location:uuid_opacity_object_location + replacement_length] = \
+                    uuid_opacity_object_replacement_value
+            if debug:
+                for uuid_opacity_object_location in uuid_opacity_object_location_list:
+                    LOGGER.debug('New UUID opacity object value written to the PDF file is: {}'.format(
+                        pdf_download[uuid_opacity_object_location:uuid_opacity_object_location + replacement_length]))
+
+        LOGGER.info('Finished editing the downloaded PDF file')
+
+        pdf_download.flush()
+
+
 def main():
     opts = docopt.docopt(__doc__)
     pdf_fn, url = (opts[k] for k in ('<pdf>', '<url>'))
     url = urlparse(url)
     dpi = float(opts['--dpi'])
     quality = str(opts['--quality']).lower()
-    title = str(opts['--title'])
+    title = opts['--title']
     range_from = int(opts['--range-from'])
     range_to = int(opts['--range-to'])
     delay = float(opts['--delay'])
+    workers = int(opts['--workers'])
+    connections = int(opts['--connections'])
+    cache_dir = str(opts['--cache-dir'])
+    cache_size = int(opts['--cache-size'])
+    no_cache = bool(opts['--no-cache'])
     save_images = bool(opts['--save-images'])
     image_subdir_prefix = str(opts['--image-subdir-prefix'])
     image_subdir_suffix = str(opts['--image-subdir-suffix'])
@@ -257,29 +968,23 @@ def main():
     if debug:
         LOGGER.setLevel(level=logging.DEBUG)
 
-    m = URL_PATH_PATTERN.match(url.path)
-    if not m:
+    url_path = parse_url_path(url.path)
+    if url_path is None:
         raise RuntimeError('URL path does not match expected pattern')
-    prefix = m.group('prefix')
+    (prefix, bucket_uuid, magazine_uuid) = url_path
 
-    q = QUALITY_PATTERN.match(quality)
-    if not q:
+    if quality not in QUALITIES:
         raise RuntimeError(
             "--quality= argument does not match any of the expected values: extralow|low|mid|high|extrahigh|original")
 
-    bu = UUID_PATTERN.match(m.group('bucket_uuid'))
-    if not bu:
+    if not UUID_PATTERN.fullmatch(bucket_uuid):
         raise RuntimeError('URL supplied does not contain a valid storage bucket UUID')
-    bucket_uuid = bu.string
 
-    mu = UUID_PATTERN.match(m.group('magazine_uuid'))
-    if not mu:
+    if not UUID_PATTERN.fullmatch(magazine_uuid):
         raise RuntimeError('URL supplied does not contain a valid magazine UUID')
-    magazine_uuid = mu.string
 
-    # NB: docopts gives the variable 'title' the string value of "None" not the type "None" when it is absent as a CLA
-    # Hence 'if title == "None"' rather than 'if title is None'
-    if title == "None":
+    # docopt gives '--title' the value None when it is absent, so a magazine can still be given the title "None"
+    if title is None:
         (title, extension) = os.path.splitext(os.path.basename(pdf_fn))
         title = title.replace('_', ' ')
 
@@ -304,6 +1009,16 @@ def main():
         raise RuntimeError(
             "Error setting the delay between page downloads. The value of --delay= must be not be less than zero.")
 
+    # Check the number of concurrent downloads and connections
+    if workers < 1 or connections < 1:
+        raise RuntimeError(
+            "Error setting the number of concurrent downloads. The values of --workers= and --connections= must be at least 1.")
+
+    # Check the cache size
+    if cache_size < 0:
+        raise RuntimeError(
+            "Error setting the size of the page cache. The value of --cache-size= must not be less than zero.")
+
     # Warn that save_images is not compatible with 'original' quality
     if save_images == True and quality == 'original':
         raise RuntimeError("Cannot save images when quality is set to 'original'.")
@@ -314,7 +1029,7 @@ def main():
             LOGGER.error('If \'--quality=original\' is used, EITHER --uuid=UUID OR --uuid-randomise MUST be present.')
             exit(1)
         if user_uuid != 'None':
-            if not UUID_PATTERN.match(user_uuid):
+            if not UUID_PATTERN.fullmatch(user_uuid):
                 raise RuntimeError('User UUID supplied with \'--uuid=\' is not a valid UUID')
         if user_uuid_randomise == True:
             user_uuid = str(uuid.uuid4())
@@ -327,6 +1042,13 @@ def main():
     LOGGER.info('Quality is {}'.format(quality))
     LOGGER.info(range_text)
     LOGGER.info('Delay between downloading each page is {} seconds'.format(delay))
+    LOGGER.info('Number of pages downloaded at the same time is {}'.format(workers))
+    LOGGER.info('Maximum number of connections to the image server is {}'.format(connections))
+    if no_cache:
+        LOGGER.info('Page cache is disabled')
+    else:
+        LOGGER.info('Page cache directory is {}'.format(cache_dir))
+        LOGGER.info('Maximum page cache size is {} MB'.format(cache_size))
     LOGGER.info('Saving images is {}'.format(str(save_images).lower()))
     LOGGER.info('User UUID is {}'.format(user_uuid))
     LOGGER.info('Randomise User UUID is {}'.format(str(user_uuid_randomise).lower()))
@@ -336,8 +1058,23 @@ def main():
     LOGGER.info('Quiet output is {}'.format(str(quiet).lower()))
     LOGGER.info('Debug output is {}'.format(str(debug).lower()))
 
+    # All requests go through one session, so connections to the servers are reused rather than set up for each request.
+    # Requests that fail with a temporary server error are retried with an increasing delay.
+    # The pages are already-compressed images, so they are requested without any further content encoding.
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = 'identity'
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=connections,
+                          max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
     if quality != 'original':
-        c = canvas.Canvas(pdf_fn)
+        # Write the image streams in binary. By default reportlab ASCII85-encodes them, which makes each embedded JPEG a
+        # quarter larger and costs an encoding pass over every page.
+        rl_config.useA85 = 0
+        # Each page's content stream only places its image, so compressing it would save a few bytes at the cost of a
+        # zlib call per page.
+        c = canvas.Canvas(pdf_fn, pageCompression=0)
         c.setTitle(title)
         with saving(c):
 
@@ -349,73 +1086,99 @@ def main():
                 image_subdir_path = os.path.join(pdf_parent_dir_name, image_subdir_name)
                 os.makedirs(image_subdir_path)
 
-            for page_num in range(range_from - 1, range_to):
-                page_url = list(url)
-                file_extension = 'jpg'
-                if quality == 'high' or quality == 'extrahigh':
-                    file_extension = 'bin'
-                page_url[2] = '{}/{}/{:04d}.{}'.format(prefix, quality, page_num, file_extension)
-                page_url = urlunparse(page_url)
-
-                try:
-                    with urlopen(page_url) as f:
-                        LOGGER.info('Downloading page {} from {}...'.format(page_num + 1, page_url))
-
-                        # if: the extralow, low & mid quality "jpg" format URLs
-                        if quality == 'extralow' or quality == 'low' or quality == 'mid':
-                            im = Image.open(f)
-                        # else: the high quality "bin" format URL
-                        elif quality == 'high':
-                            # Rewrite the beginning of the file to include the proper JPEG file type code.
-                            jpg_header = binascii.unhexlify('FFD8')
-                            filedata = f.read()[2:]
-                            imgdata = BytesIO(jpg_header + filedata)
-                            try:
-                                im = Image.open(imgdata)
-                            except PIL.UnidentifiedImageError as uie:
-                                LOGGER.error('Page {} is not a valid image file. Unable to continue; exiting...'.format(
-                                    page_num))
-                                break
-                        # else: the extrahigh quality "bin" format URL
-                        elif quality == 'extrahigh':
-                            # Rewrite the beginning of the file to include the proper RIFF/webp file type code.
-                            riff_header = binascii.unhexlify('5249')
-                            filedata = f.read()[2:]
-                            imgdata = BytesIO(riff_header + filedata)
-                            try:
-                                im = Image.open(imgdata)
-                            except PIL.UnidentifiedImageError as uie:
-                                LOGGER.error('Page {} is not a valid image file. Unable to continue; exiting...'.format(
-                                    page_num))
-                                break
-
-                except HTTPError as e:
-                    if e.code == 404 and quality == 'extrahigh':
-                        LOGGER.info('No image found. Some magazines are not available in \'extrahigh\' quality; try \'high\' quality instead. => stopping')
+            if no_cache:
+                cache_dir = None
+            else:
+                cache_dir = os.path.expanduser(cache_dir)
+                os.makedirs(cache_dir, exist_ok=True)
+
+            file_extension = 'jpg'
+            if quality == 'high' or quality == 'extrahigh':
+                file_extension = 'bin'
+
+            page_url_for = page_url_maker(url, prefix, quality, file_extension)
+
+            LOGGER.info('Determining the page number of the end of the magazine')
+            listed_pages = list_pages(session, url, prefix, quality, file_extension)
+            last_page = find_last_page(session, page_url_for, range_from - 1, range_to - 1, delay, cache_dir,
+                                       listed_pages)
+            if last_page is None:
+                last_page = range_from - 2
+                if quality == 'extrahigh':
+                    LOGGER.info('No image found. Some magazines are not available in \'extrahigh\' quality; try \'high\' quality instead. => stopping')
+                else:
+                    LOGGER.info('No image found => stopping')
+            else:
+                # Output as human-readable page numbers (counting from 1 not 0)
+                LOGGER.info('Downloading the magazine from page {} to page {}'.format(range_from, last_page + 1))
+
+            page_urls = [(page_num, page_url_for(page_num)) for page_num in range(range_from - 1, last_page + 1)]
+
+            # Download the pages in a background thread so the next pages are already arriving while the current page
+            # is being added to the PDF. The queue holds at most as many downloaded pages as there are workers.
+            page_queue = queue.Queue(maxsize=workers)
+            stop_downloading = threading.Event()
+            downloader = threading.Thread(target=download_pages,
+                                          args=(session, page_urls, quality, workers, delay, cache_dir,
+                                                page_queue, stop_downloading),
+                                          daemon=True)
+            downloader.start()
+            pages_added = 0
+            # Pages of one quality nearly always share the same pixel size, so the page size in points is only
+            # recomputed (and the canvas only resized) when an image differs from the previous one.
+            image_size = None
+            page_size = None
+            try:
+                while True:
+                    page = page_queue.get()
+                    if page is None:
                         break
-                    elif e.code == 404:
-                        LOGGER.info('No image found => stopping')
+                    if isinstance(page, Exception):
+                        raise page
+                    (page_num, filedata, image) = page
+                    if filedata is None:
+                        if quality == 'extrahigh':
+                            LOGGER.info('No image found. Some magazines are not available in \'extrahigh\' quality; try \'high\' quality instead. => stopping')
+                        else:
+                            LOGGER.info('No image found => stopping')
                         break
-                    raise e
-
-                w, h = tuple(dim / dpi for dim in im.size)
-
-                LOGGER.info('Image is {} x {} pixels and {:.2f}in x {:.2f}in at {} DPI'.format(im.width, im.height,
-                                                                                             w, h, dpi))
-                c.setPageSize((w * inch, h * inch))
-                c.drawInlineImage(im, 0, 0, w * inch, h * inch)
-                c.showPage()
-                if save_images:
-                    # Save in "human-ranged" format - starting the page count from 1, not 0.
-                    if quality == 'extrahigh':
-                        image_name = '{:04d}.webp'.format(page_num + 1)
-                        image_path = os.path.join(image_subdir_path, image_name)
-                        im.save(image_path, lossless=True)
-                    else:
-                        image_name = '{:04d}.jpg'.format(page_num + 1)
+                    if image is None:
+                        LOGGER.error('Page {} is not a valid image file. Unable to continue; exiting...'.format(
+                            page_num))
+                        break
+
+                    if image.getSize() != image_size:
+                        image_size = image.getSize()
+                        page_size = (image_size[0] / dpi * inch, image_size[1] / dpi * inch)
+                        c.setPageSize(page_size)
+
+                    if debug:
+                        LOGGER.debug('Page {} image is {} x {} pixels and {:.2f}in x {:.2f}in at {} DPI'.format(
+                            page_num + 1, image_size[0], image_size[1], page_size[0] / inch, page_size[1] / inch,
+                            dpi))
+                    c.drawImage(image, 0, 0, *page_size)
+                    c.showPage()
+                    if save_images:
+                        # Save in "human-ranged" format - starting the page count from 1, not 0.
+                        # The image is saved exactly as downloaded; re-encoding it would be slow and lossy.
+                        if quality == 'extrahigh':
+                            image_name = '{:04d}.webp'.format(page_num + 1)
+                        else:
+                            image_name = '{:04d}.jpg'.format(page_num + 1)
                         image_path = os.path.join(image_subdir_path, image_name)
-                        im.save(image_path)
-                sleep(delay)
+                        with open(image_path, 'wb') as image_file:
+                            image_file.write(filedata)
+
+                    pages_added += 1
+                    if pages_added % PROGRESS_INTERVAL == 0 or page_num == last_page:
+                        LOGGER.info('Added page {} to the PDF ({} of {} pages)'.format(page_num + 1, pages_added,
+                                                                                      len(page_urls)))
+            finally:
+                stop_downloading.set()
+                downloader.join()
+
+        if cache_dir is not None:
+            prune_cache(cache_dir, cache_size * 1024 * 1024)
 
     # else quality == 'original'
     else:
@@ -435,322 +1198,59 @@ def main():
         }
 
         LOGGER.info('Determining the page number of the end of the magazine')
-        # Check the range_to value exists as a magazine page (as the default is 999)
-        # by checking the extralow JPG for the page exists. Need HTTP response 200, not 404.
-        # Jumps between pages in 20,10,5,2,1 page intervals to avoid having to check everysingle page.
-        # The page jump size halves and the process works backwards after a page is not found.
-        file_extension = 'jpg'
-        page_num = range_from - 1
-        page_jump = 20
-        last_good_page = -1
-        last_bad_page = None
-        bad_page_count = 0
-        bad_page_limit = page_jump
-        jpeg_quality = 'extralow'
-        while True:
-            sleep(delay)
-            jpeg_url = list(url)
-            jpeg_url[2] = '{}/{}/{:04d}.{}'.format(prefix, jpeg_quality, page_num, file_extension)
-            jpeg_url = urlunparse(jpeg_url)
-            jpeg_exists_response = requests.get(url=jpeg_url)
-            if jpeg_exists_response.status_code == 200:
-                last_good_page = page_num
-                if last_good_page + 1 == last_bad_page:
-                    # Output as human-readable page numbers (counting from 1 not 0)
-                    LOGGER.info("Page {} is the last good page".format(last_good_page + 1))
-                    break
-                page_num += page_jump
-            elif jpeg_exists_response.status_code == 404:
-                last_bad_page = page_num
-                bad_page_count += 1
-                page_jump = page_jump // 2
-                if page_jump < 1:
-                    page_jump = 1
-                page_num -= page_jump
-                if page_num < 0:
-                    page_num = 0
-                if bad_page_count == bad_page_limit:
-                    raise RuntimeError("Cannot find any valid page numbers, exiting...")
-            else:
-                raise RuntimeError(
-                    "Unexpected HTTP error code encountered while probing for the last page in the magazine: HTTP error {}".format(
-                        jpeg_exists_response.status_code))
-            
-            LOGGER.debug("HTTP response code {} for URL {}".format(jpeg_exists_response.status_code, jpeg_url))
-            LOGGER.debug("Last good page number: {}, last bad page number: {}".format(last_good_page, last_bad_page))
-            LOGGER.debug("Page jump value is {}".format(page_jump))
-            LOGGER.debug("Next page to be queried is {}".format(page_num))
-
-        # Determine if magazine is to be downloaded to the end or an earlier user-specified page number
-        # Convert last_good_page to human-readable form, the same form as the range_to variable.
-        last_good_page = last_good_page + 1
-        if last_good_page < range_to:
-            range_to = last_good_page
+        # Check which pages exist by listing the extralow JPGs of the magazine or, if the server does not allow that, by
+        # requesting the headers of the extralow JPG of each page probed.
+        page_url_for = page_url_maker(url, prefix, 'extralow', 'jpg')
+        listed_pages = list_pages(session, url, prefix, 'extralow', 'jpg')
+        last_page = find_last_page(session, page_url_for, range_from - 1, range_to - 1, delay, listed_pages=listed_pages)
+        if last_page is None:
+            raise RuntimeError("Cannot find any valid page numbers, exiting...")
+
+        # Output as human-readable page numbers (counting from 1 not 0)
+        if last_page < range_to - 1:
+            range_to = last_page + 1
             LOGGER.info('Downloading the magazine from page {} to the end of the magazine on page {}'.format(range_from,
-                                                                                                           range_to,
-                                                                                                           last_good_page))
+                                                                                                           range_to))
         else:
-            LOGGER.info(
-                'Downloading the magazine from page {} to page {} instead of to the end of the magazine on page {}'.format(
-                    range_from, range_to, last_good_page))
+            LOGGER.info('Downloading the magazine from page {} to page {}'.format(range_from, range_to))
 
         # Add the required number of pages to the post_request_data
-        for page_num in range(range_from - 1, range_to):
-            post_request_data["pages[{}]".format(page_num)] = page_num
-        
+        post_request_data.update(("pages[{}]".format(page_num), page_num) for page_num in range(range_from - 1, range_to))
+
         LOGGER.debug('Post request data to be sent is:')
         LOGGER.debug(post_request_data)
 
-        pdf_response = requests.post(url=post_request_url, data=post_request_data, headers=post_request_headers)
-
-        if pdf_response.status_code == 200:
+        # The PDF is saved to disk as it arrives, rather than held in memory. It is saved and edited next to the output
+        # file under a temporary name, and only replaces the output file once it has been downloaded and edited
+        # successfully, so a failed download never leaves a truncated PDF behind.
+        # TODO: Check for any non-existent directories in the output file path and create them before saving the file.
+        partial_pdf_fn = pdf_fn + '.part'
+        try:
+            pdf_response = session.post(url=post_request_url, data=post_request_data, headers=post_request_headers,
+                                        stream=True, timeout=REQUEST_TIMEOUT)
+            try:
+                if pdf_response.status_code != 200:
+                    LOGGER.error('Unable to download magazine: HTTP error code {}'.format(pdf_response.status_code))
+                    exit(1)
+                pdf_response.raw.decode_content = True
+                with open(partial_pdf_fn, 'bw') as pdf_original:
+                    shutil.copyfileobj(pdf_response.raw, pdf_original, 1 << 20)
+                    pdf_size = pdf_original.tell()
+            finally:
+                pdf_response.close()
+            if pdf_size == 0:
+                LOGGER.error('Unable to download magazine: the server sent an empty PDF')
+                exit(1)
             LOGGER.info('Success: Downloaded magazine')
-            LOGGER.info('Editing downloaded magazine...')
-        else:
-            LOGGER.error('Unable to download magazine: HTTP error code {}'.format(pdf_response.status_code))
-            exit(1)
-
-        pdf_download = bytearray(pdf_response.content)
-
-        # Manipulate various elements of the PDF file
-        number_of_pages = range_to - (range_from - 1)
-
-        # The user UUID watermarks which printed on each page are all added together as objects beginning with
-        # '<</Length' located at the beginning of the PDF file before any of the magazine content appears.
-        # The objects are variable length flate-encoded streams that hold the User UUID amongst other compressed data.
-        # The User UUID never appears in plaintext in the PDF.
-        # It is the first object after the '<</Length' objects  which is not '<</Length' but '<</Type...' or
-        # '<</ArtBox...' or something else that signifies the start of the magazine content.
-        # There should be twice as many '<</Length' objects as pages in the magazine.
-        start_of_magazine_content_location = -1
-        LOGGER.info('Searching the PDF for the magazine content...')
-        # Find the short/long pairs of flate-encoded stream objects that hold the position and text of the user UUID watermark on each page
-        LOGGER.info('Searching for the flate-encoded stream objects containing the User UUID watermark...')
-        length_string = '<</Length '
-        next_object_string = length_string
-        # Quick and dirty way to get to the approximate location to start searching
-        # The iTextSharp object will be precisely located later, but it's a circular dependency situation here...
-        next_object_location = pdf_download.find(b'iTextSharp')
-        uuid_stream_object_list = list()
-        while next_object_location != -1:
-            next_object_location += 1
-            # Find each '<</' after the iTextSharp object
-            next_object_location = pdf_download.find(b'<</', next_object_location)
-            next_object_string = pdf_download[next_object_location:next_object_location + len(length_string)].decode(
-                encoding='cp1252')
-            # Find the first string beginning '<</...' that is not '<</Length'. That is the start of the magazine.
-            if next_object_string == length_string:
-                uuid_stream_object_list.append(next_object_location)
-            else:
-                start_of_magazine_content_location = pdf_download.find(b'>>', next_object_location) + 1
-                break
-        if len(uuid_stream_object_list) == number_of_pages * 2:
-            LOGGER.debug('Found the expected number of flate-encoded User UUID stream objects')
-            LOGGER.debug(
-                'The number of User UUID stream objects ({}) is twice then number of pages ({}). This is correct.'.format(
-                    len(uuid_stream_object_list), number_of_pages))
-        else:
-            LOGGER.warning(
-                'The number of User UUID stream objects ({}) should be twice then number of pages ({}). It is not.'.format(
-                    len(uuid_stream_object_list), number_of_pages))
-
-        # Print summary of all User UUID stream objects found
-        if debug:
-            uuid_stream_object_temp_counter = 0
-            for uuid_stream_object_offset in uuid_stream_object_list:
-                uuid_stream_object_temp_counter += 1
-                LOGGER.debug('{}: User UUID flate-encoded stream object found at offset {}'.format(
-                    uuid_stream_object_temp_counter,
-                    hex(uuid_stream_object_offset)))
-
-        # Decode the flate-encoded objects containing the User UUID objects out of curiosity
-        LOGGER.debug('Decoding the previously discovered flate-encoded objects containing the User UUID watermarks...')
-        # for uuid_object_location in uuid_placement_object_location_list:
-        uuid_object_counter = 0
-        for uuid_object_location in uuid_stream_object_list:
-            length_string_start_offset = uuid_object_location + 10
-            length_string_end_offset = pdf_download.find(b'/Filter/FlateDecode', length_string_start_offset) - 1
-            flate_encoded_stream_integer_length = int(
-                pdf_download[length_string_start_offset:length_string_end_offset + 1].decode(encoding='cp1252'))
-            flate_encoded_stream_start_offset = pdf_download.find(b'>>stream\n', uuid_object_location) + 9
-            flate_encoded_stream_end_offset = flate_encoded_stream_start_offset + flate_encoded_stream_integer_length - 1
-            flate_encoded_stream_content = pdf_download[
-                                           flate_encoded_stream_start_offset:flate_encoded_stream_end_offset + 1]
-            flate_encoded_stream_decoded_content = zlib.decompress(flate_encoded_stream_content, wbits=0)
-            LOGGER.debug('Working on User UUID flate-encoded stream number {}'.format(uuid_object_counter + 1))
-            LOGGER.debug('User UUID flate-encoded placement length string start offset is {}'.format(
-                hex(length_string_start_offset)))
-            LOGGER.debug('User UUID flate-encoded placement length string end offset is {}'.format(
-                hex(length_string_end_offset)))
-            LOGGER.debug('User UUID flate-encoded placement stream real integer value is {}'.format(
-                flate_encoded_stream_integer_length))
-            LOGGER.debug('User UUID flate-encoded placement stream start offset is {}'.format(
-                hex(flate_encoded_stream_start_offset)))
-            LOGGER.debug('User UUID flate-encoded placement stream end offset is {}'.format(
-                hex(flate_encoded_stream_end_offset)))
-            LOGGER.debug('User UUID flate-encoded placement stream content byte length is {}'.format(
-                len(flate_encoded_stream_content)))
-            LOGGER.debug('User UUID flate-encoded placement stream content is {}'.format(flate_encoded_stream_content))
-            LOGGER.debug('User UUID flate-encoded placement decoded stream content is {}'.format(
-                flate_encoded_stream_decoded_content))
-
-            if user_uuid_destroy:
-                LOGGER.info('Zeroing the user UUID flate-encoded placement stream data...')
-                flate_encoded_stream_replacement_content = bytes(
-                    '0'.encode(encoding='cp1252') * len(flate_encoded_stream_content))
-                LOGGER.debug('User UUID flate-encoded placement replacement stream content is: {}'.format(
-                    flate_encoded_stream_replacement_content))
-                pdf_download[
-                flate_encoded_stream_start_offset:flate_encoded_stream_end_offset + 1] = flate_encoded_stream_replacement_content
-            uuid_object_counter += 1
-
-        # The software that Pocketmags use to add the User UUID watermarks is called iTextSharp and it adds its own
-        # object near the beginning of the PDF in order to advertise itself and add two timestamps.
-        # Find the location of the iTextSharp object that includes the two timestamps
-        LOGGER.info('Searching for the iTextSharp object and associated properties...')
-        itextsharp_object_location = pdf_download.find(b'<</Producer(iTextSharp', 0, start_of_magazine_content_location)
-        itextsharp_object_end_location = -1
-        itextsharp_object_creationdate_property_location = -1
-        itextsharp_object_moddate_property_location = -1
-        if itextsharp_object_location == -1:
-            LOGGER.warning('Cannot find the iTextSharp object location in the PDF file.')
-        else:
-            # Find the next 'endobj' tag after the iTextSharp object hast started in order to limit the search range for
-            # the two timestamps that should be associated with it.
-            itextsharp_object_end_location = pdf_download.find(b'endobj', itextsharp_object_location)
-            LOGGER.debug('Byte offset of the iTextSharp object located at {}'.format(hex(itextsharp_object_location)))
-
-            # Find the CreationDate timestamp property location
-            itextsharp_object_creationdate_property_location = pdf_download.find(b'CreationDate',
-                                                                                 itextsharp_object_location,
-                                                                                 itextsharp_object_end_location)
-            if itextsharp_object_creationdate_property_location == -1:
-                LOGGER.warning('Cannot find the iTextSharp object\'s CreationDate property.')
-            else:
-                LOGGER.debug('Byte offset of the iTextSharp object\'s CreationDate property is {}'.format(
-                    hex(itextsharp_object_creationdate_property_location)))
-            # Find the ModDate timestamp property location
-            itextsharp_object_moddate_property_location = pdf_download.find(b'ModDate', itextsharp_object_location,
-                                                                            itextsharp_object_end_location)
-            if itextsharp_object_moddate_property_location == -1:
-                LOGGER.warning('Cannot find the iTextSharp object\'s ModDate property.')
-            else:
-                LOGGER.debug('Byte offset of the iTextSharp object\'s ModDate property is {}'.format(
-                    hex(itextsharp_object_moddate_property_location)))
 
-        # Create new timestamps for the iTextSharp object CreationDate and ModDate properties
-        # Timestamps need to be 14 char YYYYmmddHHMMSS format.
-        time_now = datetime.now()
-        time_delta = timedelta(microseconds=random.randrange(0, 999),
-                               milliseconds=random.randrange(0, 999),
-                               seconds=random.randrange(0, 60),
-                               minutes=random.randrange(0, 60),
-                               hours=random.randrange(0, 23),
-                               days=random.randrange(0, 30),
-                               weeks=random.randrange(0, 4))
-        time_replacement = time_now + time_delta
-        timestamp_length = 14
-        creationdate_date_offset_from_property_tag = 15
-        moddate_date_offset_from_property_tag = 10
-        itextsharp_object_original_content = pdf_download[itextsharp_object_location:itextsharp_object_end_location]
-        itextsharp_object_creationdate_property_original_value = pdf_download[
-                                                                 itextsharp_object_creationdate_property_location + creationdate_date_offset_from_property_tag:
-                                                                 itextsharp_object_creationdate_property_location + creationdate_date_offset_from_property_tag + timestamp_length].decode(encoding='cp1252')
-        itextsharp_object_creationdate_property_replacement_value = time_replacement.strftime('%Y%m%d%H%M%S').encode(encoding='cp1252')
-        itextsharp_object_moddate_property_original_value = pdf_download[
-                                                            itextsharp_object_moddate_property_location + moddate_date_offset_from_property_tag:
-                                                            itextsharp_object_moddate_property_location + moddate_date_offset_from_property_tag + timestamp_length].decode(encoding='cp1252')
-        itextsharp_object_moddate_property_replacement_value = time_replacement.strftime('%Y%m%d%H%M%S').encode(encoding='cp1252')
-        if timestamp_change:
-            LOGGER.info('Changing the PDFs internal timestamps...')
-            pdf_download[
-            itextsharp_object_creationdate_property_location + creationdate_date_offset_from_property_tag:
-            itextsharp_object_creationdate_property_location + creationdate_date_offset_from_property_tag + len(
-                itextsharp_object_creationdate_property_replacement_value)] = itextsharp_object_creationdate_property_replacement_value
-            pdf_download[
-            itextsharp_object_moddate_property_location + moddate_date_offset_from_property_tag:
-            itextsharp_object_moddate_property_location + moddate_date_offset_from_property_tag + len(
-                itextsharp_object_moddate_property_replacement_value)] = itextsharp_object_moddate_property_replacement_value
-        
-        LOGGER.debug('Original iTextSharp CreationDate timestamp is {}, length {}'.format(
-            itextsharp_object_creationdate_property_original_value,
-            len(itextsharp_object_creationdate_property_original_value)))
-        if timestamp_change:
-            LOGGER.debug('Replacement iTextSharp CreationDate timestamp is {}, length {}'.format(
-                itextsharp_object_creationdate_property_replacement_value,
-                len(itextsharp_object_creationdate_property_replacement_value)))
-        LOGGER.debug('Original iTextSharp ModDate timestamp is {}, length {}'.format(
-            itextsharp_object_moddate_property_original_value,
-            len(itextsharp_object_moddate_property_original_value)))
-        if timestamp_change:
-            LOGGER.debug('Replacement iTextSharp ModDate timestamp is {}, length {}'.format(
-                itextsharp_object_moddate_property_replacement_value,
-                len(itextsharp_object_moddate_property_replacement_value)))
-        LOGGER.debug('iTextSharp object before timestamp modification is: {}'.format(itextsharp_object_original_content))
-        if timestamp_change:
-            LOGGER.debug('iTextSharp object after  timestamp modification is: {}'.format(
-                pdf_download[itextsharp_object_location:itextsharp_object_end_location]))
-
-        # Find the locations of all the UUID opacity objects
-        LOGGER.info("Searching for user UUID opacity objects...")
-        uuid_opacity_object_original_value = b'<</ca 0.35/CA 0.3>>'
-        uuid_opacity_object_location_list = list()
-        uuid_opacity_object_last_location_found = -1
-        count = 0
-        latest_location = 0
-        while latest_location > -1:
-            latest_location: int = pdf_download.find(uuid_opacity_object_original_value,
-                                                     uuid_opacity_object_last_location_found + 1,
-                                                     start_of_magazine_content_location)
-            if latest_location != -1:
-                uuid_opacity_object_location_list.append(int(latest_location))
-                count += 1
-                uuid_opacity_object_last_location_found = latest_location
-            # else:
-            #     break
-
-        # Check the number of UUID opacity objects found matches the number of pages expected in the magazine
-        if len(uuid_opacity_object_location_list) != number_of_pages:
-            LOGGER.warning('The number of UUID opacity objects found does not equal the number of pages expected:')
-            LOGGER.warning('         UUID Opacity objects found: {}, pages expected: {}'.format(
-                len(uuid_opacity_object_location_list), number_of_pages))
-        else:
-            LOGGER.debug(
-                'Number of UUID opacity objects found ({}) equals the number of pages expected ({}). This is good.'.format(
-                    len(uuid_opacity_object_location_list), number_of_pages))
-
-        # Print summary of all user UUID opacity objects found
-        if debug:
-            uuid_opacity_object_temp_counter = 0
-            for uuid_opacity_object_offset in uuid_opacity_object_location_list:
-                uuid_opacity_object_temp_counter += 1
-                LOGGER.debug('{}: UUID opacity object found at offset {}'.format(uuid_opacity_object_temp_counter,
-                                                                          hex(uuid_opacity_object_offset)))
-
-        # Modify user UUID opacity objects to make the UUID less visible
-        # ca = fill (non-stroking), CA = border (stroking)
-        # NB: Do NOT change the length of the uuid_opacity_object_replacement_value string!
-        uuid_opacity_object_replacement_value = b'<</ca 0.35/CA 0.3>>'
-        if user_uuid_hide:
-            uuid_opacity_object_replacement_value = b'<</ca 0.00/CA 0.0>>'
-        if user_uuid_destroy:
-            uuid_opacity_object_replacement_value = b'0000000000000000000'
-        if user_uuid_hide or user_uuid_destroy:
-            LOGGER.info('Changing the User UUID watermark opacity...')
-            for uuid_opacity_object_location in uuid_opacity_object_location_list:
-                pdf_download[uuid_opacity_object_location:uuid_opacity_object_location + len(
-                    uuid_opacity_object_replacement_value)] = uuid_opacity_object_replacement_value
-                LOGGER.debug('New UUID opacity object value written to the PDF file is: {}'.format(pdf_download[
-                                                                                            uuid_opacity_object_location:uuid_opacity_object_location + len(
-                                                                                                uuid_opacity_object_replacement_value)]))
-
-        LOGGER.info('Finished editing the downloaded PDF file')
-
-        # Save the PDF download
-        # TODO: Check for any non-existent directories in the output file path and create them before saving the file.
-        with open(pdf_fn, 'bw') as pdf_original:
-            pdf_original.write(pdf_download)
-            LOGGER.info('Saved PDF download to {}'.format(pdf_fn))
+            edit_original_pdf(partial_pdf_fn, range_from, range_to, user_uuid_hide, user_uuid_destroy, timestamp_change,
+                              debug)
+            os.replace(partial_pdf_fn, pdf_fn)
+        except BaseException:
+            if os.path.exists(partial_pdf_fn):
+                os.remove(partial_pdf_fn)
+            raise
+        LOGGER.info('Saved PDF download to {}'.format(pdf_fn))
 
 
 if __name__ == '__main__':
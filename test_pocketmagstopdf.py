@@ -0,0 +1,361 @@
+import logging
+import os
+import tempfile
+import unittest
+import zlib
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlparse
+
+from PIL import Image
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+
+import pocketmagstopdf
+
+
+def make_jpeg(width=40, height=30):
+    """Return the bytes of a baseline JPEG image encoded by Pillow."""
+    output = BytesIO()
+    Image.new('RGB', (width, height), (200, 100, 50)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def with_frame_header(data, marker, precision=8):
+    """Return the JPEG data with its start of frame marker and sample precision replaced."""
+    data = bytearray(data)
+    offset = data.index(b'\xff\xc0')
+    data[offset + 1] = marker
+    data[offset + 4] = precision
+    return bytes(data)
+
+
+# The User UUID opacity object of each page of a PDF downloaded in 'original' quality
+OPACITY_OBJECT = b'<</ca 0.35/CA 0.3>>'
+
+
+def make_original_pdf(number_of_pages=2, stream_objects=None):
+    """
+    Return a minimal PDF laid out like one downloaded in 'original' quality: a User UUID opacity object per page, the
+    iTextSharp object, then two User UUID stream objects per page before the magazine content. stream_objects replaces
+    the stream objects.
+    """
+    if stream_objects is None:
+        stream_objects = [make_stream_object(b'User UUID placement %d' % n) for n in range(number_of_pages * 2)]
+    return b''.join([b'%PDF-1.4\n']
+                    + [b'%d 0 obj\n' % n + OPACITY_OBJECT + b'\nendobj\n' for n in range(number_of_pages)]
+                    + [b"<</Producer(iTextSharp 5.5.13)/CreationDate(D:20220101120000+00'00')"
+                       b"/ModDate(D:20220102120000+00'00')>>\nendobj\n"]
+                    + stream_objects
+                    + [b'<</Type/Page/Contents 1 0 R>>\nendobj\n%%EOF\n'])
+
+
+def make_stream_object(content, newline=b'\n'):
+    """Return a User UUID stream object holding content, flate-encoded."""
+    stream = zlib.compress(content)
+    return b'<</Length %d/Filter/FlateDecode>>stream' % len(stream) + newline + stream + b'\nendstream\nendobj\n'
+
+
+class JPEGSizeTest(unittest.TestCase):
+
+    def test_baseline(self):
+        self.assertEqual(pocketmagstopdf.jpeg_size(make_jpeg(40, 30)), (40, 30))
+
+    def test_extended_sequential_and_progressive(self):
+        for marker in (0xC1, 0xC2):
+            self.assertEqual(pocketmagstopdf.jpeg_size(with_frame_header(make_jpeg(40, 30), marker)), (40, 30))
+
+    def test_non_baseline_frame_is_rejected(self):
+        # Lossless, hierarchical and arithmetic-coded frames, which reportlab cannot embed
+        for marker in (0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            with self.assertRaises(ValueError):
+                pocketmagstopdf.jpeg_size(with_frame_header(make_jpeg(), marker))
+
+    def test_12_bit_precision_is_rejected(self):
+        with self.assertRaises(ValueError):
+            pocketmagstopdf.jpeg_size(with_frame_header(make_jpeg(), 0xC1, precision=12))
+
+    def test_not_a_jpeg(self):
+        with self.assertRaises(ValueError):
+            pocketmagstopdf.jpeg_size(b'<html></html>')
+
+
+class JPEGImageReaderTest(unittest.TestCase):
+    """
+    Checks the reportlab behaviour JPEGImageReader relies on, so that a reportlab upgrade which changes it fails here
+    rather than producing broken PDFs.
+    """
+
+    def setUp(self):
+        # As set by main()
+        use_a85 = rl_config.useA85
+        rl_config.useA85 = 0
+        self.addCleanup(setattr, rl_config, 'useA85', use_a85)
+
+    def draw_pages(self, *pages):
+        output = BytesIO()
+        c = canvas.Canvas(output, pageCompression=0)
+        for data in pages:
+            image = pocketmagstopdf.JPEGImageReader(BytesIO(data))
+            c.drawImage(image, 0, 0, *image.getSize())
+            c.showPage()
+        c.save()
+        return output.getvalue()
+
+    def test_embedded_without_decoding(self):
+        data = make_jpeg(40, 30)
+        pdf = self.draw_pages(data)
+        self.assertIn(b'/Filter [ /DCTDecode ]', pdf)
+        self.assertIn(b'/Height 30', pdf)
+        self.assertIn(b'/Width 40', pdf)
+        self.assertIn(data, pdf)
+
+    def test_identical_pages_share_one_image(self):
+        first = make_jpeg(40, 30)
+        second = make_jpeg(30, 40)
+        pdf = self.draw_pages(first, second, first)
+        self.assertEqual(pdf.count(b'/Subtype /Image'), 2)
+        self.assertEqual(pdf.count(first), 1)
+
+    def test_pixels_are_never_decoded(self):
+        image = pocketmagstopdf.JPEGImageReader(BytesIO(make_jpeg()))
+        with self.assertRaises(NotImplementedError):
+            image.getImageData()
+
+
+class PageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = temp_dir.name
+
+    def fetch_page(self, contents, file_type_code=None, page_url='https://example.com/mcmags/page/0000.jpg'):
+        """Fetch a page with the download replaced by contents, returning what was fetched and the mocked download."""
+        with mock.patch.object(pocketmagstopdf, 'download_page', return_value=contents) as download_page:
+            filedata = pocketmagstopdf.fetch_page(None, page_url, file_type_code, self.cache_dir)
+        return filedata, download_page
+
+    def write_file(self, name, size, mtime):
+        path = os.path.join(self.cache_dir, name)
+        with open(path, 'wb') as file:
+            file.write(bytes(size))
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_page_is_read_from_cache(self):
+        contents = make_jpeg()
+        (filedata, download_page) = self.fetch_page(bytearray(contents))
+        self.assertEqual(filedata, contents)
+        (filedata, download_page) = self.fetch_page(None)
+        self.assertEqual(filedata, contents)
+        download_page.assert_not_called()
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_bin_page_is_patched_before_caching(self):
+        contents = make_jpeg()
+        (filedata, download_page) = self.fetch_page(bytearray(b'\0\0' + contents[2:]),
+                                                     pocketmagstopdf.JPEG_FILE_TYPE_CODE)
+        self.assertEqual(filedata, contents)
+        (filedata, download_page) = self.fetch_page(None, pocketmagstopdf.JPEG_FILE_TYPE_CODE)
+        self.assertEqual(filedata, contents)
+
+    def test_invalid_pages_are_not_cached(self):
+        for contents in (b'', b'<html>Error</html>'):
+            (filedata, download_page) = self.fetch_page(bytearray(contents))
+            self.assertEqual(filedata, contents)
+            self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_missing_page_is_not_cached(self):
+        (filedata, download_page) = self.fetch_page(None)
+        self.assertIsNone(filedata)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_prune_removes_least_recently_used_pages(self):
+        oldest = self.write_file('a' * 40, 1000, 1000)
+        temp = self.write_file(pocketmagstopdf.CACHE_TEMP_FILE_PREFIX + 'x1_y', 1000, 2000)
+        newest = self.write_file('b' * 40, 1000, 3000)
+        pocketmagstopdf.prune_cache(self.cache_dir, 1500)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(temp))
+        self.assertTrue(os.path.exists(newest))
+
+    def test_prune_leaves_other_files_alone(self):
+        own_file = self.write_file('thesis.docx', 3000, 0)
+        page = self.write_file('c' * 40, 1000, 1000)
+        pocketmagstopdf.prune_cache(self.cache_dir, 500)
+        self.assertTrue(os.path.exists(own_file))
+        self.assertFalse(os.path.exists(page))
+
+
+class EditOriginalPDFTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.pdf_fn = os.path.join(temp_dir.name, 'magazine.pdf')
+        # Only the warnings about the PDF are of interest, not the progress of the editing
+        log_level = pocketmagstopdf.LOGGER.level
+        pocketmagstopdf.LOGGER.setLevel(logging.WARNING)
+        self.addCleanup(pocketmagstopdf.LOGGER.setLevel, log_level)
+
+    def edit(self, pdf, number_of_pages=2, hide=False, destroy=False, timestamp_change=False, debug=False):
+        """Edit pdf with edit_original_pdf() and return the edited PDF."""
+        with open(self.pdf_fn, 'wb') as pdf_file:
+            pdf_file.write(pdf)
+        pocketmagstopdf.edit_original_pdf(self.pdf_fn, 1, number_of_pages, hide, destroy, timestamp_change, debug)
+        with open(self.pdf_fn, 'rb') as pdf_file:
+            edited = pdf_file.read()
+        self.assertEqual(len(edited), len(pdf))
+        return edited
+
+    def test_checks_only(self):
+        pdf = make_original_pdf()
+        self.assertEqual(self.edit(pdf), pdf)
+        self.assertEqual(self.edit(pdf, debug=True), pdf)
+
+    def test_object_counts_are_checked(self):
+        with self.assertLogs(pocketmagstopdf.LOGGER, 'WARNING') as logs:
+            self.edit(make_original_pdf(2), number_of_pages=3)
+        self.assertEqual(len(logs.output), 2)
+
+    def test_hide(self):
+        pdf = make_original_pdf()
+        self.assertEqual(self.edit(pdf, hide=True), pdf.replace(OPACITY_OBJECT, b'<</ca 0.00/CA 0.0>>'))
+
+    def test_destroy(self):
+        contents = [b'User UUID placement %d' % n for n in range(4)]
+        pdf = make_original_pdf(stream_objects=[make_stream_object(content) for content in contents])
+        expected = pdf.replace(OPACITY_OBJECT, b'0' * len(OPACITY_OBJECT))
+        for content in contents:
+            stream = zlib.compress(content)
+            expected = expected.replace(stream, b'0' * len(stream))
+        self.assertEqual(self.edit(pdf, destroy=True, debug=True), expected)
+
+    def test_timestamp_change(self):
+        pdf = make_original_pdf()
+        edited = self.edit(pdf, timestamp_change=True)
+        creationdate = pdf.index(b'CreationDate(D:') + 15
+        moddate = pdf.index(b'ModDate(D:') + 10
+        timestamp = edited[creationdate:creationdate + 14]
+        self.assertTrue(timestamp.isdigit())
+        self.assertNotEqual(timestamp, pdf[creationdate:creationdate + 14])
+        self.assertEqual(edited[moddate:moddate + 14], timestamp)
+        expected = (pdf[:creationdate] + timestamp + pdf[creationdate + 14:moddate] + timestamp
+                    + pdf[moddate + 14:])
+        self.assertEqual(edited, expected)
+
+    def test_timestamp_change_without_itextsharp_object(self):
+        pdf = make_original_pdf().replace(b'<</Producer(iTextSharp', b'<</Producer(iTextPDF__')
+        with self.assertLogs(pocketmagstopdf.LOGGER, 'WARNING'):
+            self.assertEqual(self.edit(pdf, timestamp_change=True), pdf)
+
+    def test_destroy_with_carriage_return_line_feed_after_stream(self):
+        contents = [b'User UUID placement %d' % n for n in range(4)]
+        pdf = make_original_pdf(stream_objects=[make_stream_object(content, b'\r\n') for content in contents])
+        expected = pdf.replace(OPACITY_OBJECT, b'0' * len(OPACITY_OBJECT))
+        for content in contents:
+            stream = zlib.compress(content)
+            expected = expected.replace(stream, b'0' * len(stream))
+        self.assertEqual(self.edit(pdf, destroy=True), expected)
+
+    def test_malformed_stream_objects_are_skipped(self):
+        # No stream keyword, no /Filter/FlateDecode, an invalid length and a length past the next object
+        malformed_objects = [b'<</Length 20/Filter/FlateDecode>>\n' + bytes(20) + b'\nendobj\n',
+                             b'<</Length 20>>stream\n' + bytes(20) + b'\nendstream\nendobj\n',
+                             b'<</Length abc/Filter/FlateDecode>>stream\n' + bytes(20) + b'\nendstream\nendobj\n',
+                             b'<</Length 9999/Filter/FlateDecode>>stream\n' + bytes(20) + b'\nendstream\nendobj\n']
+        pdf = make_original_pdf(stream_objects=malformed_objects)
+        with self.assertLogs(pocketmagstopdf.LOGGER, 'WARNING') as logs:
+            edited = self.edit(pdf, destroy=True)
+        self.assertEqual(sum('skipping it' in message for message in logs.output), 4)
+        # Only the opacity objects are changed
+        self.assertEqual(edited, pdf.replace(OPACITY_OBJECT, b'0' * len(OPACITY_OBJECT)))
+
+
+class ListPagesTest(unittest.TestCase):
+
+    url = urlparse('https://mcdatastore.blob.core.windows.net/mcmags/f3786b15-4b19-456e-9b58-2af137a35bcd/'
+                   'ba9c5bcb-cf96-4215-a2f5-841ddb4a119c/mid/0000.jpg')
+    blob_prefix = 'f3786b15-4b19-456e-9b58-2af137a35bcd/ba9c5bcb-cf96-4215-a2f5-841ddb4a119c/mid/'
+
+    def list_pages(self, content, status_code=200):
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=status_code, content=content, url='')
+        (prefix, bucket_uuid, magazine_uuid) = pocketmagstopdf.parse_url_path(self.url.path)
+        return pocketmagstopdf.list_pages(session, self.url, prefix, 'mid', 'jpg')
+
+    def enumeration_results(self, names, next_marker=''):
+        blobs = ''.join('<Blob><Name>{}</Name><Properties /></Blob>'.format(name) for name in names)
+        return ('<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="mcmags"><Blobs>{}</Blobs>'
+                '<NextMarker>{}</NextMarker></EnumerationResults>'.format(blobs, next_marker)).encode()
+
+    def test_pages_are_listed(self):
+        names = [self.blob_prefix + '{:04d}.jpg'.format(n) for n in (0, 1, 2, 5)]
+        # Other qualities, file types and names are ignored
+        names += [self.blob_prefix.replace('/mid/', '/low/') + '0003.jpg', self.blob_prefix + '0004.bin',
+                  self.blob_prefix + '12.jpg', self.blob_prefix + 'cover.jpg']
+        self.assertEqual(self.list_pages(self.enumeration_results(names)), {0, 1, 2, 5})
+
+    def test_no_list(self):
+        self.assertIsNone(self.list_pages(b'<Error><Code>ResourceNotFound</Code></Error>', 404))
+        self.assertIsNone(self.list_pages(b'not XML'))
+        self.assertIsNone(self.list_pages(b'<Error><Code>AuthorizationFailure</Code></Error>'))
+
+    def test_list_without_pages(self):
+        self.assertIsNone(self.list_pages(self.enumeration_results([])))
+        self.assertIsNone(self.list_pages(self.enumeration_results(['other/magazine/mid/0000.jpg'])))
+
+    def test_continued_list(self):
+        names = [self.blob_prefix + '{:04d}.jpg'.format(n) for n in range(3)]
+        self.assertIsNone(self.list_pages(self.enumeration_results(names, next_marker='2!12!MDAwMDA')))
+
+
+class FindLastPageTest(unittest.TestCase):
+
+    def find_last_page(self, number_of_pages, first_page, last_page, listed_pages=None):
+        """
+        Find the last page of a magazine with number_of_pages pages, returning it and the pages that were probed.
+        """
+        probed_pages = []
+
+        def page_exists(session, page_url, cache_dir=None):
+            probed_pages.append(page_url)
+            return page_url < number_of_pages
+
+        with mock.patch.object(pocketmagstopdf, 'page_exists', page_exists):
+            found = pocketmagstopdf.find_last_page(None, lambda page_num: page_num, first_page, last_page, 0,
+                                                   listed_pages=listed_pages)
+        return found, probed_pages
+
+    def test_listed_pages(self):
+        listed_pages = set(range(20))
+        self.assertEqual(self.find_last_page(0, 0, 998, listed_pages), (19, []))
+        self.assertEqual(self.find_last_page(0, 4, 9, listed_pages), (9, []))
+        self.assertEqual(self.find_last_page(0, 20, 998, listed_pages), (None, []))
+        # A gap in the list ends the magazine
+        self.assertEqual(self.find_last_page(0, 0, 998, listed_pages - {7}), (6, []))
+
+    def test_probed_pages(self):
+        (found, probed_pages) = self.find_last_page(100, 0, 998)
+        self.assertEqual(found, 99)
+        self.assertLessEqual(len(probed_pages), 2 * 7 + 2)
+        self.assertEqual(self.find_last_page(0, 0, 998), (None, [0]))
+
+    def test_every_magazine_length(self):
+        for number_of_pages in range(40):
+            for first_page in range(5):
+                for last_page in range(first_page, 45):
+                    with self.subTest(number_of_pages=number_of_pages, first_page=first_page, last_page=last_page):
+                        (found, probed_pages) = self.find_last_page(number_of_pages, first_page, last_page)
+                        if first_page >= number_of_pages:
+                            self.assertIsNone(found)
+                        else:
+                            self.assertEqual(found, min(number_of_pages - 1, last_page))
+                        # No page is probed twice, and no page outside the range is probed
+                        self.assertEqual(len(probed_pages), len(set(probed_pages)))
+                        self.assertTrue(all(first_page <= page_num <= last_page for page_num in probed_pages))
+
+
+if __name__ == '__main__':
+    unittest.main()